@@ -1,26 +1,115 @@
 import os
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends
-from fastapi.responses import FileResponse
+import asyncio
+import hashlib
+import hmac
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, Form, Query, HTTPException, Request, Depends
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.sessions import SessionMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.background import BackgroundTask
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
-from bson import ObjectId
-from typing import List
-from datetime import datetime
-import aiofiles
-import tempfile
+from pymongo.write_concern import WriteConcern
+from bson import Binary, ObjectId
+from bson.errors import InvalidId
+from gridfs.errors import NoFile
+from typing import List, Optional
+from urllib.parse import quote
+from datetime import datetime, timezone
 import uvicorn
 
 # ---------- ENV ----------
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/pwan")
 SESSION_KEY = os.environ.get("SESSION_KEY", "devsessionkey")
+ADMIN_COOKIE = "adm"
+ADMIN_MAX_AGE = 14 * 24 * 60 * 60
+# Connection pool size is per worker process: keep MONGO_MAX_POOL x workers
+# below the server's connection limit (net.maxIncomingConnections)
+MONGO_MAX_POOL = int(os.environ.get("MONGO_MAX_POOL", "50"))
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", "3600"))
+# In production nginx serves public/ (see nginx.conf); set SERVE_STATIC=1 for local dev
+SERVE_STATIC = os.environ.get("SERVE_STATIC") == "1"
+
+# ---------- DATABASE ----------
+# GridFS chunk size and how many chunk bytes to buffer per insert_many
+GRIDFS_CHUNK_SIZE = 1 << 20
+GRIDFS_FLUSH_BYTES = 4 << 20
+
+# Fields the admin dashboard needs from each submission, with ObjectIds
+# converted to strings server-side
+SUBMISSION_LIST_PROJECTION = {
+    "_id": {"$toString": "$_id"},
+    "fullName": 1,
+    "email": 1,
+    "paymentDate": 1,
+    "accountDetails": 1,
+    "createdAt": 1,
+    "files": {
+        "$map": {
+            "input": {"$ifNull": ["$files", []]},
+            "as": "f",
+            "in": {
+                "fileId": {"$toString": "$$f.fileId"},
+                "filename": "$$f.filename",
+                "contentType": "$$f.contentType",
+            },
+        }
+    },
+}
+
+# Max GridFS uploads in flight per request, so one submission can't drain the pool
+UPLOAD_CONCURRENCY = 8
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect and build indexes before the server starts accepting requests
+    client = AsyncIOMotorClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL,
+        minPoolSize=5,
+        maxIdleTimeMS=60000,
+        serverSelectionTimeoutMS=3000,
+        waitQueueTimeoutMS=2000,
+        retryWrites=True,
+        # zstd preferred, then snappy, with zlib (stdlib) as a fallback everywhere
+        compressors="zstd,snappy,zlib",
+        zlibCompressionLevel=6
+    )
+    db = client.get_default_database()
+    await db.command("ping")
+    await db["uploads.chunks"].create_index([("files_id", 1), ("n", 1)], unique=True)
+    await db["uploads.files"].create_index("metadata.sha256")
+    await db.submissions.create_index([("createdAt", -1)])
+    await db.submissions.create_index([("email", 1), ("createdAt", -1)])
+
+    app.state.client = client
+    app.state.db = db
+    # The uploaded files are the durable record, so the small submission doc
+    # doesn't wait for a journal flush; uploads.* keeps the default concern
+    app.state.submissions = db.get_collection(
+        "submissions", write_concern=WriteConcern(w=1, j=False)
+    )
+    app.state.fs_bucket = AsyncIOMotorGridFSBucket(
+        db, bucket_name="uploads", chunk_size_bytes=GRIDFS_CHUNK_SIZE
+    )
+    yield
+    client.close()
 
 # ---------- APP ----------
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
-# ---------- SESSION ----------
-app.add_middleware(SessionMiddleware, secret_key=SESSION_KEY)
+# ---------- COMPRESSION ----------
+class APIGZipMiddleware(GZipMiddleware):
+    # File downloads are mostly jpeg/pdf and already compressed
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/admin/file/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(APIGZipMiddleware, minimum_size=1024, compresslevel=5)
 
 # ---------- CORS ----------
 app.add_middleware(
@@ -31,24 +120,92 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ---------- STATIC FILES ----------
-app.mount("/", StaticFiles(directory="public", html=True), name="public")
+# ---------- GRIDFS ----------
+async def upload_from_stream_batched(db, filename, source, metadata=None):
+    # Same layout as fs_bucket.upload_from_stream, but chunks are written
+    # with insert_many instead of one insert_one per chunk. `source` is read
+    # asynchronously (e.g. an UploadFile) so the event loop is never blocked
+    fs_files, fs_chunks = db["uploads.files"], db["uploads.chunks"]
+    file_id = ObjectId()
+    batch, batch_bytes, n, length = [], 0, 0, 0
+    try:
+        while True:
+            data = await source.read(GRIDFS_CHUNK_SIZE)
+            if not data:
+                break
+            batch.append({"files_id": file_id, "n": n, "data": Binary(data)})
+            batch_bytes += len(data)
+            length += len(data)
+            n += 1
+            if batch_bytes >= GRIDFS_FLUSH_BYTES:
+                await fs_chunks.insert_many(batch, ordered=False)
+                batch, batch_bytes = [], 0
+        if batch:
+            await fs_chunks.insert_many(batch, ordered=False)
 
-# ---------- DATABASE ----------
-client = AsyncIOMotorClient(MONGO_URI)
-db = client.get_default_database()
-fs_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="uploads")
-submissions_collection = db.submissions
+        await fs_files.insert_one({
+            "_id": file_id,
+            "length": length,
+            "chunkSize": GRIDFS_CHUNK_SIZE,
+            "uploadDate": datetime.now(timezone.utc),
+            "filename": filename,
+            "metadata": metadata
+        })
+    except BaseException:
+        # Don't leave orphaned chunks behind, including when the upload is cancelled
+        await fs_chunks.delete_many({"files_id": file_id})
+        raise
+    return file_id
+
+def file_sha256(f):
+    # Runs in a worker thread; hashlib releases the GIL while hashing
+    h = hashlib.sha256()
+    f.seek(0)
+    for chunk in iter(lambda: f.read(GRIDFS_CHUNK_SIZE), b""):
+        h.update(chunk)
+    f.seek(0)
+    return h.hexdigest()
+
+def parse_object_id(value: str) -> ObjectId:
+    # Reject malformed ids before they cost a database round-trip
+    if len(value) != 24:
+        raise HTTPException(status_code=400, detail="Invalid id")
+    try:
+        return ObjectId(value)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid id")
 
 # ---------- ADMIN DEPENDENCY ----------
+# The admin cookie is "<issued-at>.<hmac-sha256>" rather than a full session dict
+def _sign(payload: str) -> str:
+    sig = hmac.new(SESSION_KEY.encode(), payload.encode(), hashlib.sha256).hexdigest()
+    return f"{payload}.{sig}"
+
+def _verify(token: str) -> bool:
+    payload, _, sig = token.rpartition(".")
+    # Cookie values are client-controlled latin-1; compare bytes so non-ASCII
+    # input is simply a mismatch rather than a TypeError
+    expected = _sign(payload).rpartition(".")[2]
+    if not hmac.compare_digest(expected.encode(), sig.encode("latin-1", "replace")):
+        return False
+    try:
+        return int(payload) + ADMIN_MAX_AGE > time.time()
+    except ValueError:
+        return False
+
 def admin_required(request: Request):
-    if not request.session.get("admin"):
+    # Verified once per request, however many dependencies ask
+    if not hasattr(request.state, "is_admin"):
+        token = request.cookies.get(ADMIN_COOKIE)
+        request.state.is_admin = bool(token) and _verify(token)
+    if not request.state.is_admin:
         raise HTTPException(status_code=403, detail="Admin access only")
 
 # ---------- ROUTES ----------
 
 @app.post("/submit-poa")
 async def submit_poa(
+    request: Request,
     fullName: str = Form(...),
     email: str = Form(...),
     paymentDate: str = Form(...),
@@ -58,19 +215,56 @@ async def submit_poa(
     if not documents:
         raise HTTPException(status_code=400, detail="At least one document required")
 
-    files_meta = []
-    for doc in documents:
-        # Upload to GridFS
-        file_id = await fs_bucket.upload_from_stream(
-            doc.filename,
-            doc.file,
-            metadata={"originalName": doc.filename, "contentType": doc.content_type}
-        )
-        files_meta.append({
+    db = request.app.state.db
+    upload_slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    async def _upload(doc: UploadFile):
+        async with upload_slots:
+            # Identical files (e.g. a retried submission) reuse the stored copy.
+            # Name and type are part of the match because downloads take them
+            # from the stored file's metadata
+            digest = await asyncio.to_thread(file_sha256, doc.file)
+            existing = await db["uploads.files"].find_one(
+                {
+                    "metadata.sha256": digest,
+                    "metadata.originalName": doc.filename,
+                    "metadata.contentType": doc.content_type
+                },
+                {"_id": 1}
+            )
+            if existing:
+                return existing["_id"], digest
+            file_id = await upload_from_stream_batched(
+                db,
+                doc.filename,
+                doc,
+                metadata={
+                    "originalName": doc.filename,
+                    "contentType": doc.content_type,
+                    "sha256": digest
+                }
+            )
+            return file_id, digest
+
+    # Upload to GridFS concurrently. If one upload fails, cancel and wait for
+    # the rest before the form's UploadFiles are closed on the way out
+    tasks = [asyncio.ensure_future(_upload(doc)) for doc in documents]
+    try:
+        uploads = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    files_meta = [
+        {
             "fileId": str(file_id),
             "filename": doc.filename,
-            "contentType": doc.content_type
-        })
+            "contentType": doc.content_type,
+            "sha256": digest
+        }
+        for (file_id, digest), doc in zip(uploads, documents)
+    ]
 
     submission = {
         "fullName": fullName,
@@ -78,63 +272,116 @@ async def submit_poa(
         "paymentDate": paymentDate,
         "accountDetails": accountDetails,
         "files": files_meta,
-        "createdAt": datetime.utcnow()
+        "createdAt": datetime.now(timezone.utc)
     }
 
-    result = await submissions_collection.insert_one(submission)
+    result = await request.app.state.submissions.insert_one(submission)
     return {"success": True, "id": str(result.inserted_id)}
 
 # ---------- ADMIN LOGIN ----------
 @app.post("/admin/login")
-async def admin_login(request: Request):
-    request.session["admin"] = True
+async def admin_login(response: Response):
+    response.set_cookie(
+        ADMIN_COOKIE,
+        _sign(str(int(time.time()))),
+        max_age=ADMIN_MAX_AGE,
+        httponly=True,
+        samesite="strict"
+    )
     return {"success": True, "message": "Logged in as admin"}
 
 @app.post("/admin/logout")
-async def admin_logout(request: Request, admin=Depends(admin_required)):
-    request.session.clear()
+async def admin_logout(response: Response, admin=Depends(admin_required)):
+    response.delete_cookie(ADMIN_COOKIE, httponly=True, samesite="strict")
     return {"success": True, "message": "Logged out"}
 
 # ---------- LIST SUBMISSIONS ----------
 @app.get("/admin/submissions")
-async def list_submissions(admin=Depends(admin_required)):
-    submissions = []
-    cursor = submissions_collection.find().sort("createdAt", -1)
-    async for doc in cursor:
-        doc["_id"] = str(doc["_id"])
-        for f in doc.get("files", []):
-            f["fileId"] = str(f["fileId"])
-        submissions.append(doc)
-    return submissions
+async def list_submissions(
+    request: Request,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None,
+    admin=Depends(admin_required)
+):
+    # Keyset pagination: pass the last _id of a page as `before` to get the next one
+    query = {}
+    if before:
+        query["_id"] = {"$lt": parse_object_id(before)}
+
+    # _id only grows, so the newest one identifies the current data set and
+    # dashboard polls with a matching If-None-Match skip the query entirely.
+    # The ETag ignores limit/before; that's only safe because browsers cache
+    # per URL and submissions are never updated or deleted. Revisit if either changes.
+    submissions_collection = request.app.state.submissions
+    last = await submissions_collection.find_one({}, sort=[("_id", -1)], projection={"_id": 1})
+    etag = f'W/"{last["_id"]}"' if last else 'W/"empty"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"_id": -1}},
+        {"$limit": limit},
+        {"$project": SUBMISSION_LIST_PROJECTION},
+    ]
+    submissions = await submissions_collection.aggregate(pipeline).to_list(length=limit)
+    # Returned directly so FastAPI skips jsonable_encoder; orjson handles datetimes
+    return ORJSONResponse(submissions, headers=headers)
 
 # ---------- DOWNLOAD FILE ----------
 @app.get("/admin/file/{file_id}")
-async def download_file(file_id: str, admin=Depends(admin_required)):
+async def download_file(file_id: str, request: Request, admin=Depends(admin_required)):
+    oid = parse_object_id(file_id)
     try:
-        oid = ObjectId(file_id)
-        file_info = await db["uploads.files"].find_one({"_id": oid})
-        if not file_info:
-            raise HTTPException(status_code=404, detail="File not found")
-
-        # Stream to temporary file
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            async for chunk in fs_bucket.open_download_stream(oid):
-                tmp_file.write(chunk)
-            tmp_path = tmp_file.name
-
-        return FileResponse(
-            tmp_path,
-            media_type=file_info.get("metadata", {}).get("contentType", "application/octet-stream"),
-            filename=file_info.get("metadata", {}).get("originalName", file_info["filename"])
-        )
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        grid_out = await request.app.state.fs_bucket.open_download_stream(oid)
+    except NoFile:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Stream chunks straight from GridFS to the client
+    metadata = grid_out.metadata or {}
+    filename = metadata.get("originalName", grid_out.filename)
+    # Same encoding as FileResponse: headers are latin-1, so anything that
+    # needs quoting goes in the RFC 5987 filename* form
+    quoted = quote(filename)
+    if quoted != filename:
+        content_disposition = f"attachment; filename*=utf-8''{quoted}"
+    else:
+        content_disposition = f'attachment; filename="{filename}"'
+    return StreamingResponse(
+        grid_out,
+        media_type=metadata.get("contentType", "application/octet-stream"),
+        headers={
+            "Content-Disposition": content_disposition,
+            "Content-Length": str(grid_out.length),
+        },
+        background=BackgroundTask(grid_out.close)
+    )
+
+# ---------- STATIC FILES ----------
+class CachedStaticFiles(StaticFiles):
+    # Let browsers keep static assets instead of revalidating on every load
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("Cache-Control", f"public, max-age={STATIC_MAX_AGE}")
+        return response
+
+# Mounted last so it doesn't shadow the API routes above
+if SERVE_STATIC:
+    app.mount("/", CachedStaticFiles(directory="public", html=True), name="public")
 
 # ---------- START SERVER ----------
+# Production alternative:
+#   gunicorn -k uvicorn.workers.UvicornWorker -w $WEB_CONCURRENCY main:app
+# Each worker has its own Mongo pool, so keep MONGO_MAX_POOL x workers under the server limit
 if __name__ == "__main__":
+    dev = os.environ.get("ENV") == "dev"
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=int(os.environ.get("PORT", 8000)),
-        reload=True
+        loop="uvloop",
+        http="httptools",
+        workers=1 if dev else int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        reload=dev
     )